@@ -0,0 +1,121 @@
+'''Load test for the database service (db/service.py).
+
+Builds a synthetic database, serves it from a separate process, and hammers it from
+several client threads for a fixed time, reporting throughput and latency. Run from the
+repository root:
+
+    $ python3 -m db.loadtest [--clients N] [--seconds S] [--write-ratio R]
+
+'''
+import argparse, http.client, json, os, random, statistics, subprocess, sys, tempfile, time
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+import db.primedb as db
+
+from threading import Thread
+
+
+PORT = 8643
+
+
+def build_synthetic_db(path, products=200, parts_per_product=4, relics_per_tier=60):
+    '''Create a database at `path` filled with made-up products, parts and relics.'''
+    db.set_path(path)
+    db.open_()
+    rng = random.Random(0)
+    prime = db.ItemType.get(name='Prime')
+    tiers = list(db.RelicTier.select())
+    rarities = list(db.Rarity.select())
+
+    with db._primedb.atomic():
+        relics = [db.Relic.create(tier=tier, code="S{}".format(i), vaulted=rng.random() < 0.5)
+                  for tier in tiers for i in range(relics_per_tier)]
+        for p in range(products):
+            product = db.Item.create(name="Synthetic{} Prime".format(p), type_=prime)
+            for q in range(parts_per_product):
+                part = db.Item.create(name="Synthetic{} Prime Part{}".format(p, q),
+                                      type_=prime, owned=rng.randrange(3))
+                db.BuildRequirement.create(needs=part, builds=product,
+                                           need_count=rng.choice((1, 1, 2)))
+                for relic in rng.sample(relics, 3):
+                    db.Containment.create(contains=part, inside=relic,
+                                          rarity=rng.choice(rarities))
+    db.close()
+
+
+def client(paths, item_ids, seconds, write_ratio, latencies, errors):
+    '''Send requests over one keep-alive connection until time runs out.'''
+    conn = http.client.HTTPConnection('127.0.0.1', PORT)
+    rng = random.Random()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        if rng.random() < write_ratio:
+            body = json.dumps({rng.choice(item_ids): rng.randrange(3)})
+            conn.request('POST', '/inventory', body, {'Content-Type': 'application/json'})
+        else:
+            conn.request('GET', rng.choice(paths))
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200: errors.append(response.status)
+    conn.close()
+
+
+def wait_for_server(timeout=30):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORT)
+            conn.request('GET', '/relics')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Service did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the database service.")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.01,
+                        help="fraction of requests that write to the inventory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.sqlite')
+        build_synthetic_db(path)
+        db.set_path(path)
+        item_ids = [i for (i,) in db.Item.select(db.Item.id).tuples()]
+        relic_ids = [i for (i,) in db.Relic.select(db.Relic.id).tuples()]
+        db.close()
+        paths = (['/items', '/relics', '/vault', '/inventory']
+                 + ['/items/{}'.format(i) for i in item_ids]
+                 + ['/items/{}/tree'.format(i) for i in item_ids]
+                 + ['/relics/{}'.format(i) for i in relic_ids])
+
+        server = subprocess.Popen([sys.executable, '-m', 'db.service', '--db', path,
+                                   '--port', str(PORT), '--workers', str(args.clients)],
+                                  stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server()
+            latencies, errors = [], []
+            threads = [Thread(target=client, args=(paths, item_ids, args.seconds,
+                                                   args.write_ratio, latencies, errors))
+                       for _ in range(args.clients)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    print("{} requests from {} clients in {}s: {:.0f} requests/s, {} errors"
+          .format(len(latencies), args.clients, args.seconds,
+                  len(latencies) / args.seconds, len(errors)))
+    print("Latency: median {:.1f}ms, p90 {:.1f}ms, p99 {:.1f}ms"
+          .format(statistics.median(latencies) * 1000,
+                  latencies[int(len(latencies) * 0.9)] * 1000,
+                  latencies[int(len(latencies) * 0.99)] * 1000))
+
+if __name__ == '__main__': main()
@@ -1,7 +1,14 @@
-import certifi, urllib3, os
+import certifi, multiprocessing, urllib3, os, re, time, weakref
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from threading import Lock
 from peewee import *
+from peewee import chunked
+from playhouse.migrate import SqliteMigrator, migrate
 from bs4 import BeautifulSoup, SoupStrainer
 from kivy.logger import Logger
+from db.wikipages import parse_product_requirements
 
 
 # TODO rework population functions to work with existing database
@@ -9,8 +16,17 @@ from kivy.logger import Logger
 
 DB_PATH = 'primedb.sqlite'
 WIKI_HOME = 'http://warframe.fandom.com'
+DUCATS_BY_RARITY = (15, 45, 100) # lowest ducat value of parts, by Rarity.ordinal
+DEFAULT_PROFILE = 'Default'
+SNAPSHOT_INTERVAL = 500                  # inventory events between snapshots
+HISTORY_RETENTION = timedelta(days=365)  # how long inventory events are kept
+DROP_TABLES_URL = 'https://www.warframe.com/droptables'
+REQUIREMENT_WORKERS = None # one worker process per CPU
 
 _primedb = SqliteDatabase(DB_PATH)
+_prepared = False
+_prepare_lock = Lock()
+_profile = None
 
 
 class BaseModel(Model):
@@ -48,11 +64,96 @@ class Item(DataModel):
     page = TextField(null = True)
     '''Wiki page for the item'''
 
-    owned = IntegerField(default=0)
-    '''Number of items in the player's inventory'''
+    image_url = TextField(null = True)
+    '''URL of the item's image on the wiki'''
+
+    estimated_ducats = IntegerField(default=0)
+    '''Estimate of the ducats received for trading the item in.
+
+    Neither data source lists ducat values, so this is the lowest value of a part of the
+    rarest rarity the item is found at in relics. Actual values may be higher, e.g. 25 or
+    65 rather than 15 or 45. Recomputed by estimate_ducats on each population.
+
+    '''
+
+    @property
+    def owned(self):
+        '''Number of items in the current profile's inventory.
+
+        Loaded on first access unless the item was selected with select_with_owned, then
+        cached on the instance. Assigned values are written to the inventory on save.
+
+        '''
+        if getattr(self, '_owned', None) is None:
+            self._owned = 0 if self.id is None else current_profile().owned(self)
+        return self._owned
+
+    @owned.setter
+    def owned(self, value):
+        self._owned = value
+        self._owned_dirty = True
+
+    def save(self, *args, **kwargs):
+        existed = self.id is not None
+        result = super().save(*args, **kwargs)
+        if getattr(self, '_owned_dirty', False):
+            self._owned_dirty = False
+            profile = current_profile()
+            profile._write_inventory({self.id: self._owned})
+            if existed: emit(OwnedChanged(self, profile))
+        return result
+
+    @classmethod
+    def select_with_owned(cls, *fields, profile=None):
+        '''Select items along with their owned counts for a profile, in one query.
+
+        PARAMETERS
+        fields: Fields to select. If none are given, selects whole items.
+        profile: Profile to load owned counts from. Defaults to the current profile.
 
-    # ducats = IntegerField(default=0)
-    '''Currently unimplemented'''
+        '''
+        if profile is None: profile = current_profile()
+        return (cls
+                .select(*(fields or (cls,)), fn.COALESCE(Inventory.owned, 0).alias('_owned'))
+                .join(Inventory, JOIN.LEFT_OUTER,
+                      on=((Inventory.item == cls.id) & (Inventory.profile == profile)))
+                .switch(cls))
+
+    @classmethod
+    def select_surplus(cls, profile=None):
+        '''Select parts owned beyond what is needed to build every unbuilt product.
+
+        A product is unbuilt if the profile owns none of it. Computed in a single aggregate
+        query. Each selected item has `owned`, `needed` (total across unbuilt products),
+        `surplus` and `value` (surplus times estimated ducats) loaded. They are ordered by
+        value, highest first, then by surplus. As value is only an estimate (see
+        Item.estimated_ducats), the order is approximate.
+
+        PARAMETERS
+        profile: Profile whose inventory to use. Defaults to the current profile.
+
+        '''
+        if profile is None: profile = current_profile()
+        PartInventory = Inventory.alias()
+        ProductInventory = Inventory.alias()
+        owned = fn.COALESCE(PartInventory.owned, 0)
+        needed = fn.SUM(Case(None, [(fn.COALESCE(ProductInventory.owned, 0) == 0,
+                                     BuildRequirement.need_count)], 0))
+        surplus = owned - needed
+        return (cls
+                .select(cls, owned.alias('_owned'), needed.alias('needed'),
+                        surplus.alias('surplus'),
+                        (surplus * cls.estimated_ducats).alias('value'))
+                .join(BuildRequirement, on=(BuildRequirement.needs == cls.id))
+                .join(PartInventory, JOIN.LEFT_OUTER,
+                      on=((PartInventory.item == cls.id)
+                          & (PartInventory.profile == profile)))
+                .join(ProductInventory, JOIN.LEFT_OUTER,
+                      on=((ProductInventory.item == BuildRequirement.builds)
+                          & (ProductInventory.profile == profile)))
+                .group_by(cls.id)
+                .having(surplus > 0)
+                .order_by(SQL('value').desc(), SQL('surplus').desc(), cls.name))
 
     @classmethod
     def select_all_products(cls):
@@ -83,14 +184,14 @@ class Item(DataModel):
     @property
     def builds(self):
         return (self.__class__
-                .select()
+                .select_with_owned()
                 .join(BuildRequirement, on=BuildRequirement.builds)
                 .where(BuildRequirement.needs == self))
 
     @property
     def needs(self):
         return (self.__class__
-                .select()
+                .select_with_owned()
                 .join(BuildRequirement, on=BuildRequirement.needs)
                 .where(BuildRequirement.builds == self))
 
@@ -98,6 +199,22 @@ class Item(DataModel):
     def vaulted(self):
         return all(r.vaulted for r in self.relics)
 
+    @property
+    def farm_locations(self):
+        '''Best drop to farm for each relic containing this item.'''
+        return (Drop
+                .select(Drop, Relic, RelicTier, Mission, MissionSector)
+                .join(BestDrop, on=(BestDrop.drop == Drop.id))
+                .join(Containment, on=(Containment.inside == BestDrop.relic))
+                .switch(Drop)
+                .join(Relic)
+                .join(RelicTier)
+                .switch(Drop)
+                .join(Mission)
+                .join(MissionSector)
+                .where(Containment.contains == self)
+                .order_by(Drop.chance.desc()))
+
 
 class RelicTier(DataModel):
     '''Tier of a relic (e.g. Lith, Meso, etc.).'''
@@ -118,6 +235,14 @@ class Relic(DataModel):
     class Meta:
         indexes = ( (('tier', 'code'), True), ) # should be "indices," bad peewee =/
 
+    def save(self, *args, **kwargs):
+        vaulted_changed = self.id is not None and 'vaulted' in self._dirty
+        result = super().save(*args, **kwargs)
+        if vaulted_changed:
+            bump_generation()
+            emit(RelicVaulted(self))
+        return result
+
     @property
     def name(self):
         return "{} {}".format(self.tier, self.code)
@@ -130,13 +255,243 @@ class Relic(DataModel):
                 .where(Containment.inside == self)
                 .group_by(Item))
 
+    @property
+    def best_drop(self):
+        '''Drop with the best chance of rewarding this relic, or None if it has no drops.'''
+        return (Drop
+                .select(Drop, Mission, MissionSector)
+                .join(BestDrop, on=(BestDrop.drop == Drop.id))
+                .switch(Drop)
+                .join(Mission)
+                .join(MissionSector)
+                .where(BestDrop.relic == self)
+                .first())
+
+
+class Profile(DataModel):
+    '''Player whose inventory is tracked. All profiles share the same catalogue of items.'''
+
+    class Meta:
+        indexes = ( (('name',), True), )
+
+    def owned(self, item):
+        '''Get the number of an item in this profile's inventory.'''
+        row = (Inventory.select(Inventory.owned)
+               .where((Inventory.profile == self) & (Inventory.item == item))
+               .first())
+        return row.owned if row else 0
+
+    def inventory(self, items=None):
+        '''Get the owned count of every item in this profile's inventory, in one query.
+
+        PARAMETERS
+        items: If given, IDs of the only items to get counts for. Queried in batches of
+               500, so it may be any length.
+
+        RETURNS
+        Dict mapping item IDs to owned counts. Items never recorded are left out.
+
+        '''
+        query = (Inventory
+                 .select(Inventory.item, Inventory.owned)
+                 .where(Inventory.profile == self))
+        if items is None:
+            return dict(query.tuples())
+        counts = {}
+        for batch in chunked(list(items), 500):
+            counts.update(query.where(Inventory.item.in_(batch)).tuples())
+        return counts
+
+    def set_inventory(self, counts):
+        '''Set the owned counts of many items at once.
+
+        Writes with one upsert per 300 items, in a single transaction, and bumps the
+        database generation. Each change is recorded in the inventory history, which is
+        snapshotted and compacted every SNAPSHOT_INTERVAL changes. Emits a single
+        InventoryChanged event if any count changed.
+
+        PARAMETERS
+        counts: Dict mapping item IDs to owned counts.
+
+        '''
+        changed = self._write_inventory(counts)
+        if changed: emit(InventoryChanged(self, changed))
+
+    def _write_inventory(self, counts):
+        '''Write owned counts as set_inventory does, without emitting events.
+
+        RETURNS
+        Dict mapping the IDs of items whose count changed to their new counts.
+
+        '''
+        now = int(time.time())
+        rows = [(self.id, item_id, owned) for item_id, owned in counts.items()]
+        with _primedb.atomic():
+            if not self.snapshots.exists(): self.take_snapshot(now) # start of history
+            old = self.inventory(counts)
+            for batch in chunked(rows, 300):
+                (Inventory
+                 .insert_many(batch, fields=[Inventory.profile, Inventory.item,
+                                             Inventory.owned])
+                 .on_conflict(conflict_target=[Inventory.profile, Inventory.item],
+                              preserve=[Inventory.owned])
+                 .execute())
+
+            events = [(self.id, item_id, now, owned - old.get(item_id, 0))
+                      for item_id, owned in counts.items() if owned != old.get(item_id, 0)]
+            for batch in chunked(events, 200):
+                (InventoryEvent
+                 .insert_many(batch, fields=[InventoryEvent.profile, InventoryEvent.item,
+                                             InventoryEvent.time, InventoryEvent.delta])
+                 .execute())
+            bump_generation()
+
+            if events and self.events_since_snapshot() >= SNAPSHOT_INTERVAL:
+                self.take_snapshot(now)
+                self.compact_history()
+        return {item_id: counts[item_id] for _, item_id, _, _ in events}
+
+    # Inventory History #
+    def latest_snapshot(self, before=None):
+        '''Get the most recent snapshot of this profile's inventory, or None.
+
+        PARAMETERS
+        before: If given, only consider snapshots taken at or before this datetime.
+
+        '''
+        query = self.snapshots
+        if before is not None: query = query.where(InventorySnapshot.time <= _timestamp(before))
+        return query.order_by(InventorySnapshot.time.desc(), InventorySnapshot.id.desc()).first()
+
+    def events_since_snapshot(self):
+        '''Count the inventory changes recorded since the latest snapshot.'''
+        snapshot = self.latest_snapshot()
+        last_event = snapshot.last_event if snapshot else 0
+        return (self.inventory_events
+                .where(InventoryEvent.id > last_event)
+                .count())
+
+    def take_snapshot(self, when=None):
+        '''Record a checkpoint of this profile's whole inventory.
+
+        PARAMETERS
+        when: datetime or Unix time of the snapshot. Defaults to now.
+
+        '''
+        when = int(time.time()) if when is None else _timestamp(when)
+        with _primedb.atomic():
+            last_event = (InventoryEvent.select(fn.MAX(InventoryEvent.id))
+                          .where(InventoryEvent.profile == self).scalar()) or 0
+            snapshot = InventorySnapshot.create(profile=self, time=when, last_event=last_event)
+            (InventorySnapshotEntry
+             .insert_from(Inventory.select(Value(snapshot.id), Inventory.item, Inventory.owned)
+                                   .where((Inventory.profile == self) & (Inventory.owned != 0)),
+                          fields=[InventorySnapshotEntry.snapshot, InventorySnapshotEntry.item,
+                                  InventorySnapshotEntry.owned])
+             .execute())
+        return snapshot
+
+    def compact_history(self, retention=None):
+        '''Discard inventory history older than the retention period.
+
+        Events older than the newest snapshot that is itself older than the retention period
+        are deleted, along with older snapshots. That snapshot is kept as the base for
+        later queries, so history back to it stays exact; earlier history is lost.
+
+        PARAMETERS
+        retention: timedelta of history to keep. Defaults to HISTORY_RETENTION.
+
+        '''
+        if retention is None: retention = HISTORY_RETENTION
+        base = self.latest_snapshot(before=datetime.now(timezone.utc) - retention)
+        if base is None: return
+        with _primedb.atomic():
+            (InventoryEvent.delete()
+             .where((InventoryEvent.profile == self)
+                    & (InventoryEvent.id <= base.last_event))
+             .execute())
+            old = (InventorySnapshot.select(InventorySnapshot.id)
+                   .where((InventorySnapshot.profile == self)
+                          & (InventorySnapshot.id != base.id)
+                          & (InventorySnapshot.time <= base.time)))
+            InventorySnapshotEntry.delete().where(InventorySnapshotEntry.snapshot.in_(old)).execute()
+            InventorySnapshot.delete().where(InventorySnapshot.id.in_(old)).execute()
+
+    def inventory_as_of(self, when):
+        '''Get this profile's inventory as it was at a point in time.
+
+        Reads the nearest earlier snapshot and the events recorded after it.
+
+        PARAMETERS
+        when: datetime to get the inventory at.
+
+        RETURNS
+        Dict mapping item IDs to owned counts, as for inventory(). Empty if `when` is before
+        the start of the retained history.
+
+        '''
+        snapshot = self.latest_snapshot(before=when)
+        if snapshot is None: return {}
+        counts = dict(snapshot.entries
+                      .select(InventorySnapshotEntry.item, InventorySnapshotEntry.owned)
+                      .tuples())
+        tail = (InventoryEvent
+                .select(InventoryEvent.item, fn.SUM(InventoryEvent.delta))
+                .where((InventoryEvent.profile == self)
+                       & (InventoryEvent.id > snapshot.last_event)
+                       & (InventoryEvent.time <= _timestamp(when)))
+                .group_by(InventoryEvent.item)
+                .tuples())
+        for item_id, delta in tail:
+            counts[item_id] = counts.get(item_id, 0) + delta
+        return {item_id: owned for item_id, owned in counts.items() if owned}
+
+    def gains_per_week(self, start=None, end=None):
+        '''Count the items gained in each week, from the events in the retained history.
+
+        PARAMETERS
+        start: If given, only count gains at or after this datetime.
+        end: If given, only count gains before this datetime.
+
+        RETURNS
+        Dict mapping the date of each week's Monday (UTC) to the number of items gained.
+        Weeks without gains are left out.
+
+        '''
+        week = (InventoryEvent.time - _MONDAY) / _WEEK # integer division in SQLite
+        query = (InventoryEvent
+                 .select(week, fn.SUM(InventoryEvent.delta))
+                 .where((InventoryEvent.profile == self) & (InventoryEvent.delta > 0)))
+        if start is not None: query = query.where(InventoryEvent.time >= _timestamp(start))
+        if end is not None: query = query.where(InventoryEvent.time < _timestamp(end))
+        return {datetime.fromtimestamp(w * _WEEK + _MONDAY, timezone.utc).date(): gained
+                for w, gained in query.group_by(week).tuples()}
+
+
+_WEEK = 7 * 24 * 60 * 60
+_MONDAY = 4 * 24 * 60 * 60 # the Unix epoch was a Thursday
+
+
+def _timestamp(when):
+    '''Convert a datetime to Unix time, passing numbers through.'''
+    return int(when.timestamp()) if isinstance(when, datetime) else int(when)
+
+
+class MissionSector(DataModel):
+    '''Region of the star chart (e.g. Earth, Void, etc.).'''
+    pass
 
-# class MissionSector (BaseModel):
-#     pass
 
+class Mission(DataModel):
+    '''Mission that can reward relics.'''
+    sector = ForeignKeyField(MissionSector, backref='missions')
+    mission_type = CharField(null=True) # e.g. Survival
 
-# class Mission (DataModel):
-#     sector = ForeignKeyField(MissionSector)
+    class Meta:
+        indexes = ( (('sector', 'name'), True), )
+
+    def __str__(self):
+        return "{}/{}".format(self.sector, self.name)
 
 
 # Relation Tables #
@@ -161,17 +516,199 @@ class Containment(RelationModel):
     # class Meta:
     #     indexes = ( (('contains', 'inside'), True), )
 
+    def save(self, *args, **kwargs):
+        added = self.id is None
+        result = super().save(*args, **kwargs)
+        if added: emit(ContainmentAdded(self))
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        emit(ContainmentRemoved(self))
+        return result
+
+
+class Inventory(RelationModel):
+    '''Relation representing the number of an item in a profile's inventory.'''
+    profile = ForeignKeyField(Profile, backref='inventory_entries', on_delete='CASCADE')
+    item = ForeignKeyField(Item, backref='inventory_entries', on_delete='CASCADE')
+    owned = IntegerField(default=0)
+    class Meta:
+        indexes = ( (('profile', 'item'), True), )
+
+
+class Drop(RelationModel):
+    '''Relation representing a relic being a reward from a mission.'''
+    drops = ForeignKeyField(Relic, backref='drops', index=True)
+    location = ForeignKeyField(Mission, backref='drops', index=True)
+    rotation = CharField(max_length=1, default='') # empty for missions without rotations
+    chance = FloatField()
+    class Meta:
+        indexes = ( (('drops', 'location', 'rotation'), True), )
+
+    def __str__(self):
+        return "{} <- {}{}".format(self.drops, self.location,
+                                   " ({})".format(self.rotation) if self.rotation else "")
+
+
+class BestDrop(RelationModel):
+    '''Relation representing the drop with the best chance of rewarding a relic.
+
+    Precomputed by refresh_best_drops.
+
+    '''
+    relic = ForeignKeyField(Relic, unique=True)
+    drop = ForeignKeyField(Drop)
+
+
+# History Tables #
+class InventoryEvent(RelationModel):
+    '''Change to the number of an item in a profile's inventory. Append-only.'''
+    profile = ForeignKeyField(Profile, backref='inventory_events', on_delete='CASCADE')
+    item = ForeignKeyField(Item, on_delete='CASCADE')
+    time = IntegerField() # Unix time
+    delta = IntegerField()
+    class Meta:
+        indexes = ( (('profile', 'time'), False), )
+
+
+class InventorySnapshot(BaseModel):
+    '''Checkpoint of a profile's whole inventory, used as a base for history queries.'''
+    profile = ForeignKeyField(Profile, backref='snapshots', on_delete='CASCADE')
+    time = IntegerField() # Unix time
+    last_event = IntegerField(default=0)
+    '''ID of the last InventoryEvent reflected in the snapshot.'''
+    class Meta:
+        indexes = ( (('profile', 'time'), False), )
+
+
+class InventorySnapshotEntry(RelationModel):
+    '''Relation representing the number of an item in an inventory snapshot.'''
+    snapshot = ForeignKeyField(InventorySnapshot, backref='entries', on_delete='CASCADE')
+    item = ForeignKeyField(Item, on_delete='CASCADE')
+    owned = IntegerField()
+    class Meta:
+        indexes = ( (('snapshot', 'item'), True), )
+
+
+# Metadata Tables #
+class Generation(BaseModel):
+    '''Counter incremented whenever the contents of the database change.
+
+    Lets caches of query results tell whether they are stale. Holds at most one row; use
+    get_generation and bump_generation rather than accessing it directly.
+
+    '''
+    value = IntegerField(default=0)
+
+
+def get_generation():
+    '''Get the current database generation.'''
+    row = Generation.select(Generation.value).first()
+    return row.value if row else 0
+
+
+def bump_generation():
+    '''Increment the database generation, marking cached query results as stale.'''
+    if not Generation.update(value=Generation.value + 1).execute():
+        Generation.create(value=1)
+
+
+MODELS = [ItemType, Item, RelicTier, Relic, Rarity, Profile, MissionSector, Mission,
+          BuildRequirement, Containment, Inventory, Drop, BestDrop,
+          InventoryEvent, InventorySnapshot, InventorySnapshotEntry, Generation]
+'''All database models, in order of creation.'''
+
+
+# Change Events #
+class ChangeEvent:
+    '''Base class for notifications of changes to the database.
+
+    Events are emitted after the change has been saved, from whichever thread made the
+    change. Changes made by bulk queries (e.g. `Item.update()`) do not emit events.
+
+    '''
+    pass
+
+
+class InventoryChanged(ChangeEvent):
+    '''The numbers of one or more items in a profile's inventory changed.
+
+    `counts` maps the ID of each item whose number changed to its new number.
+
+    '''
+    def __init__(self, profile, counts):
+        self.profile = profile
+        self.counts = counts
+
+
+class OwnedChanged(InventoryChanged):
+    '''The number of an item in a profile's inventory changed.'''
+    def __init__(self, item, profile):
+        super().__init__(profile, {item.id: item.owned})
+        self.item = item
+        self.owned = item.owned
+
+
+class RelicVaulted(ChangeEvent):
+    '''A relic was vaulted or unvaulted.'''
+    def __init__(self, relic):
+        self.relic = relic
+        self.vaulted = relic.vaulted
 
-# class Drop (RelationModel):
-#     drops = ForeignKeyField(Relic)
-#     location = ForeignKeyField(Mission)
+
+class ContainmentAdded(ChangeEvent):
+    '''A relic was found to contain an item.'''
+    def __init__(self, containment):
+        self.containment = containment
+
+
+class ContainmentRemoved(ChangeEvent):
+    '''A relic no longer contains an item.'''
+    def __init__(self, containment):
+        self.containment = containment
+
+
+_subscribers = defaultdict(list)
+_subscribers_lock = Lock()
+
+
+def subscribe(event_type, callback):
+    '''Call `callback` with every event of type `event_type` (or a subclass).
+
+    Bound methods are held by weak reference, so subscribing does not keep their object
+    alive.
+
+    '''
+    ref = (weakref.WeakMethod(callback) if hasattr(callback, '__self__')
+           else (lambda: callback))
+    with _subscribers_lock:
+        _subscribers[event_type].append(ref)
+
+
+def unsubscribe(event_type, callback):
+    '''Stop calling `callback` with events of type `event_type`.'''
+    with _subscribers_lock:
+        _subscribers[event_type] = [r for r in _subscribers[event_type]
+                                    if r() not in (None, callback)]
+
+
+def emit(event):
+    '''Notify subscribers of a change event.'''
+    callbacks = []
+    with _subscribers_lock:
+        for event_type, refs in _subscribers.items():
+            if isinstance(event, event_type):
+                refs[:] = [r for r in refs if r() is not None]
+                callbacks += [r() for r in refs]
+    for callback in callbacks:
+        if callback is not None: callback(event)
 
 
 # Initialization Code #
 def setup():
     '''Do first-time database setup'''
-    _primedb.create_tables([ItemType, Item, RelicTier, Relic, Rarity,
-                            BuildRequirement, Containment])
+    _primedb.create_tables(MODELS)
 
     RelicTier(name='Lith', ordinal=0).save()
     RelicTier(name='Meso', ordinal=1).save()
@@ -184,12 +721,79 @@ def setup():
 
     ItemType(name='Prime').save()
 
+    Profile(name=DEFAULT_PROFILE).save()
+
+
+def update_schema():
+    '''Add any tables and columns missing from a database created by an older version.'''
+    _primedb.create_tables(MODELS, safe=True)
+    migrator = SqliteMigrator(_primedb)
+    for model in (Item,):
+        table = model._meta.table_name
+        existing = {c.name for c in _primedb.get_columns(table)}
+        missing = [f for f in model._meta.sorted_fields if f.column_name not in existing]
+        for field in missing:
+            Logger.info("Database: Adding column {}.{}".format(table, field.column_name))
+            migrate(migrator.add_column(table, field.column_name, field))
+    migrate_owned_column()
+
+
+def migrate_owned_column():
+    '''Move owned counts from the old Item.owned column to the default profile.'''
+    table = Item._meta.table_name
+    if 'owned' not in {c.name for c in _primedb.get_columns(table)}: return
+
+    Logger.info("Database: Moving {}.owned to the {} profile".format(table, DEFAULT_PROFILE))
+    with _primedb.atomic():
+        profile = Profile.get_or_create(name=DEFAULT_PROFILE)[0]
+        (Inventory
+         .insert_from(Item.select(Value(profile.id), Item.id, SQL('owned'))
+                          .where(SQL('owned') != 0),
+                      fields=[Inventory.profile, Inventory.item, Inventory.owned])
+         .on_conflict_ignore()
+         .execute())
+        migrate(SqliteMigrator(_primedb).drop_column(table, 'owned'))
+
+
+def prepare():
+    '''Create the database, or bring an existing one up to date.
+
+    Uses its own connection, so may be called from a background thread before the
+    database is opened. Does nothing after the first call.
+
+    '''
+    global _prepared
+    with _prepare_lock:
+        if _prepared: return
+        needs_setup = not os.path.isfile(DB_PATH)
+        with _primedb.connection_context():
+            if needs_setup: setup()
+            else: update_schema()
+        _prepared = True
+
+
+def set_path(path):
+    '''Use the database file at `path` instead of DB_PATH. Call before opening.'''
+    global DB_PATH, _prepared, _profile
+    DB_PATH = path
+    _primedb.init(path)
+    _prepared = False
+    _profile = None
+
+
+def enable_wal():
+    '''Switch the database to write-ahead logging, so reads do not block on writes.
+
+    The setting is stored in the database file, so only needs to be done once.
+
+    '''
+    _primedb.pragma('journal_mode', 'wal')
+
 
 def open_():
     '''Open a connection to the database.'''
-    needs_setup = not os.path.isfile(DB_PATH)
-    _primedb.connect()
-    if needs_setup: setup()
+    prepare()
+    _primedb.connect(reuse_if_open=True)
 
 
 def close():
@@ -197,15 +801,71 @@ def close():
     _primedb.close()
 
 
+# Inventory Code #
+def current_profile():
+    '''Get the profile whose inventory Item.owned reads and writes.'''
+    global _profile
+    if _profile is None: _profile = Profile.get_or_create(name=DEFAULT_PROFILE)[0]
+    return _profile
+
+
+def set_profile(profile):
+    '''Make Item.owned read and write a different profile's inventory.
+
+    Items that have already loaded their owned count keep the old profile's count.
+
+    PARAMETERS
+    profile: Profile, or name of a profile, to switch to. Created if it does not exist.
+
+    '''
+    global _profile
+    if isinstance(profile, str): profile = Profile.get_or_create(name=profile)[0]
+    _profile = profile
+
+
+def set_owned_counts(counts, profile=None):
+    '''Set the owned counts of many items in a single transaction.
+
+    Emits one InventoryChanged event and bumps the database generation once.
+
+    PARAMETERS
+    counts: Dict mapping item IDs to owned counts.
+    profile: Profile whose inventory to update. Defaults to the current profile.
+
+    '''
+    (profile or current_profile()).set_inventory(counts)
+
+
 # Population Code #
 def population_setup():
     '''Call before populating the database.'''
+    containments = list(Containment.select())
     Containment.delete().execute()
+    for containment in containments: emit(ContainmentRemoved(containment))
 
 
 def population_teardown():
     '''Call after populating the database.'''
-    pass
+    estimate_ducats()
+    bump_generation()
+
+
+def estimate_ducats():
+    '''Recompute every item's estimated ducat value from the relics it is found in.
+
+    Items are valued by the rarest rarity they are found at, using DUCATS_BY_RARITY.
+    Values are overwritten, so they follow changes to relic contents. Items not found in
+    any relic are left as they are.
+
+    '''
+    rarest = (Containment
+              .select(fn.MAX(Rarity.ordinal))
+              .join(Rarity)
+              .where(Containment.contains == Item.id))
+    (Item
+     .update(estimated_ducats=Case(rarest, list(enumerate(DUCATS_BY_RARITY))))
+     .where(Item.id.in_(Containment.select(Containment.contains)))
+     .execute())
 
 
 def get_relic_drop_table(http):
@@ -244,8 +904,8 @@ def process_relic_drop_table_row(row, http):
     # Identify Product and Create if Needed #
     product_selection = Item.select().where(Item.name == product_name)
     if product_selection.count() == 0:
-        product = Item.create(name=product_name, type_=prime_type,
-                              page=http.request('GET', product_url).data)
+        page = http.request('GET', product_url).data
+        product = Item.create(name=product_name, type_=prime_type, page=page)
     else:
         product = product_selection[0]
 
@@ -256,6 +916,9 @@ def process_relic_drop_table_row(row, http):
         relic = Relic.create(tier=relic_tier, code=relic_code, vaulted=vaulted)
     else:
         relic = relic_selection[0]
+        if relic.vaulted != vaulted:
+            relic.vaulted = vaulted
+            relic.save()
 
     # Identify Item and Create if Needed #
     item_selection = Item.select().where(Item.name == full_name)
@@ -270,34 +933,203 @@ def process_relic_drop_table_row(row, http):
     
     return item, product, relic
 
+def apply_product_requirements(results):
+    '''Save products' images and parts' required counts and images in a single transaction.
+
+    PARAMETERS
+    results: Iterable of tuples as returned by parse_product_requirements.
+
+    '''
+    with _primedb.atomic():
+        for product_id, product_image_url, parts in results:
+            product = Item.get_by_id(product_id)
+            if product_image_url and product.image_url != product_image_url:
+                product.image_url = product_image_url
+                product.save()
+            for part_name, count, image_url in parts:
+                part_query = Item.select().where(Item.name.contains(product.name)
+                                                 & Item.name.contains(part_name))
+                if part_query:
+                    part = part_query[0]
+                    if image_url and not part.image_url:
+                        part.image_url = image_url
+                        part.save()
+                    relation = (BuildRequirement.select()
+                                .where((BuildRequirement.builds==product)
+                                       & (BuildRequirement.needs==part)))
+                    if relation and count:
+                        relation[0].need_count=count
+                        relation[0].save()
+                        Logger.debug("Database: {} needs {} {}"
+                                    .format(product.name, count, part.name))
+
+
 def calculate_product_requirement_quantities(product):
     '''Calculate how many of each part are required to build a product.
 
-    Extracts information from the foundry table on the product's wiki page.
+    Extracts information from the foundry table on the product's wiki page. The product's
+    image is taken from the page's infobox, and part images from the foundry table.
 
     '''
-    foundry_table = product.soup.find('table', class_='foundrytable')
-    for req in [r for r in foundry_table.contents[3].find_all('td') if r.a]:
-        count = req.text.strip()
-        part_name = req.a['title'].strip()
-        part_query = Item.select().where(Item.name.contains(product.name)
-                                         & Item.name.contains(part_name))
-        if part_query:
-            part = part_query[0]
-            relation = (BuildRequirement.select()
-                        .where((BuildRequirement.builds==product)
-                               & (BuildRequirement.needs==part)))
-            if relation and count:
-                relation[0].need_count=count
-                relation[0].save()
-                Logger.debug("Database: {} needs {} {}"
-                            .format(product.name, count, part.name))
+    apply_product_requirements([parse_product_requirements(product.id, product.page)])
+
+
+def calculate_all_requirement_quantities(products, workers=None, progress=None):
+    '''Calculate requirement quantities and images for many products at once.
+
+    Pages are parsed in a pool of worker processes, so that parsing neither runs
+    sequentially nor holds the GIL in this process. The results are then saved in a single
+    transaction. Workers are spawned rather than forked, as this is called from a thread
+    of the running app. Spawned workers import the main module, so it must not run the
+    app or open a window when imported.
+
+    PARAMETERS
+    products: Products to calculate requirements for.
+    workers: Number of worker processes. Defaults to REQUIREMENT_WORKERS.
+    progress: If given, called with no arguments each time a product has been parsed.
+
+    '''
+    products = list(products)
+    parsed = []
+    if workers is None: workers = REQUIREMENT_WORKERS
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        results = executor.map(parse_product_requirements,
+                               [p.id for p in products], [p.page for p in products],
+                               chunksize=4)
+        for product, result in zip(products, results):
+            _, _, parts = result
+            if not parts:
+                Logger.warning("Database: No foundry table found for {}".format(product))
+            parsed.append(result)
+            if progress: progress()
+    apply_product_requirements(parsed)
+
+
+def get_mission_reward_table(http):
+    '''Download the mission reward table from the official drop tables.
+
+    The whole page is downloaded into memory, but only its mission rewards section is
+    parsed. Every row of the table is returned at once, so the rows are held in memory
+    while they are processed.
+
+    RETURNS
+    List of the table's rows, for iter_mission_rewards.
+
+    '''
+    r = http.request('GET', DROP_TABLES_URL)
+    data = r.data
+
+    # The drop tables page is large; only parse the mission rewards section #
+    start = data.find(b'id="missionRewards"')
+    end = data.find(b'<h3', start + 1)
+    if start >= 0 and end >= 0: data = data[start:end]
+
+    table = BeautifulSoup(data, 'lxml', parse_only=SoupStrainer('tr'))
+    return table.find_all('tr')
+
+
+_MISSION_HEADER = re.compile(r'^(.+?)/(.+?)(?: \((.+)\))?$') # e.g. "Earth/Mantle (Capture)"
+_RELIC_REWARD = re.compile(r'^(\w+) (\w+) Relic$')           # e.g. "Lith V1 Relic"
+_CHANCE = re.compile(r'\(([\d.]+)%\)')                       # e.g. "Uncommon (11.06%)"
+
+
+def iter_mission_rewards(rows, progress=None):
+    '''Extract relic rewards from the rows of the mission reward table.
+
+    Header rows name the mission or rotation that the following reward rows belong to.
+    Rewards other than relics, and missions whose headers cannot be parsed, are skipped.
+
+    PARAMETERS
+    rows: Rows of the table, as returned by get_mission_reward_table.
+    progress: If given, called with no arguments after each row is processed.
+
+    YIELDS
+    (sector_name, mission_name, mission_type, rotation, tier_name, relic_code, chance)
+    tuples, with chance as a fraction.
+
+    '''
+    mission = None
+    rotation = ''
+    for row in rows:
+        if row.th:
+            header = row.th.text.strip()
+            if header.startswith('Rotation '):
+                rotation = header[len('Rotation '):]
+            else:
+                match = _MISSION_HEADER.match(header)
+                mission = match.groups() if match else None
+                rotation = ''
+        elif mission and len(row.find_all('td')) == 2:
+            name, chance = (td.text.strip() for td in row.find_all('td'))
+            relic_match = _RELIC_REWARD.match(name)
+            chance_match = _CHANCE.search(chance)
+            if relic_match and chance_match:
+                yield (mission + (rotation,) + relic_match.groups()
+                       + (float(chance_match.group(1)) / 100,))
+        if progress: progress()
+
+
+def ingest_mission_rewards(rewards):
+    '''Replace all drops with the given mission rewards, and refresh best drops.
+
+    Done in a single transaction, so readers never see the drops partly replaced.
+
+    PARAMETERS
+    rewards: Iterable of tuples as yielded by iter_mission_rewards. Consumed as it is
+             saved, so may be a generator, though the table rows it is made from are
+             already in memory.
+
+    '''
+    tiers = {t.name: t for t in RelicTier.select()}
+    sectors, missions, relics = {}, {}, {}
+    with _primedb.atomic():
+        BestDrop.delete().execute()
+        Drop.delete().execute()
+        for sector_name, mission_name, mission_type, rotation, tier_name, code, chance in rewards:
+            tier = tiers.get(tier_name)
+            if tier is None: continue # e.g. Requiem relics
+
+            if sector_name not in sectors:
+                sectors[sector_name] = MissionSector.get_or_create(name=sector_name)[0]
+            sector = sectors[sector_name]
+
+            if (sector_name, mission_name) not in missions:
+                missions[sector_name, mission_name] = Mission.get_or_create(
+                    sector=sector, name=mission_name,
+                    defaults={'mission_type': mission_type})[0]
+            mission = missions[sector_name, mission_name]
+
+            if (tier_name, code) not in relics:
+                relics[tier_name, code] = Relic.get_or_create(tier=tier, code=code)[0]
+            relic = relics[tier_name, code]
+
+            (Drop.insert(drops=relic, location=mission, rotation=rotation, chance=chance)
+             .on_conflict_replace().execute())
+            Logger.debug("Database: {} {} drops from {}/{} {}"
+                         .format(tier_name, code, sector_name, mission_name, rotation))
+        refresh_best_drops()
+        bump_generation()
+
+
+def refresh_best_drops():
+    '''Recompute the best drop for each relic.'''
+    best = (Drop
+            .select(Drop.drops, Drop.id, fn.MAX(Drop.chance)) # SQLite returns the max row
+            .group_by(Drop.drops)
+            .tuples())
+    with _primedb.atomic():
+        BestDrop.delete().execute()
+        for batch in chunked([(relic, drop) for relic, drop, _ in best], 100):
+            BestDrop.insert_many(batch, fields=[BestDrop.relic, BestDrop.drop]).execute()
+
 
 def populate(http):
     '''Populate the database.'''
     table = get_relic_drop_table(http)
     for row in table: process_relic_drop_table_row(row, http)
-    for product in Item.select_all_products(): calculate_product_requirement_quantities(product)
+    calculate_all_requirement_quantities(Item.select_all_products())
+    ingest_mission_rewards(iter_mission_rewards(get_mission_reward_table(http)))
 
 
 # Testing Code #
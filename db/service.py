@@ -0,0 +1,354 @@
+'''Local HTTP/JSON service over the prime database.
+
+Run from the repository root:
+
+    $ python3 -m db.service [--db PATH] [--port PORT] [--workers N]
+
+ENDPOINTS
+GET  /items              All items, with owned counts.
+GET  /items/<id>         An item, with its relics, products and components.
+GET  /items/<id>/tree    Build tree of an item, with needed and owned counts.
+GET  /relics             All relics, with vaulted status.
+GET  /relics/<id>        A relic, with its contents and best drop.
+GET  /vault              Vaulted status of every item found in relics.
+GET  /inventory          Owned counts of the current profile, as {item_id: owned}.
+POST /inventory          Set owned counts of the current profile from a JSON body of
+                         {item_id: owned}.
+GET  /profiles           All profiles.
+GET  /profiles/<id>/inventory
+POST /profiles/<id>/inventory
+                         As /inventory, for a particular profile.
+
+Owned counts in item responses are those of the current profile.
+
+Connections are handled by a fixed pool of worker threads, each of which keeps its own
+read connection open. A worker serves one connection at a time, for as long as the client
+keeps it alive, so the number of workers is also the number of clients that can be served
+at once; further clients wait for a worker. Connections idle for longer than
+IDLE_TIMEOUT seconds are closed to free their workers. Writes are serialized. GET responses are cached until the database
+generation changes.
+
+'''
+import argparse, json, os, re
+os.environ.setdefault('KIVY_NO_ARGS', '1') # keep Kivy from parsing our arguments
+import db.primedb as db
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Lock
+
+from kivy.logger import Logger
+from peewee import DoesNotExist, chunked, fn
+
+
+DEFAULT_PORT = 8642
+DEFAULT_WORKERS = 16
+IDLE_TIMEOUT = 5 # seconds a kept-alive connection may sit idle before it is closed
+CACHE_SIZE = 1024
+
+
+# Serialization #
+ITEM_COLUMNS = (db.Item.id, db.Item.name, db.Item.image_url,
+                fn.COALESCE(db.Inventory.owned, 0).alias('owned'))
+'''Columns of an item summary, for queries built on Item.select_with_owned.'''
+
+
+def item_summary(item):
+    return {'id': item.id, 'name': item.name, 'owned': item.owned,
+            'image_url': item.image_url}
+
+
+def relic_summary(relic):
+    return {'id': relic.id, 'name': relic.name, 'vaulted': relic.vaulted}
+
+
+def drop_summary(drop):
+    return {'mission': str(drop.location), 'mission_type': drop.location.mission_type,
+            'rotation': drop.rotation, 'chance': drop.chance}
+
+
+def get_items():
+    return list(db.Item.select_with_owned().select(*ITEM_COLUMNS)
+                .order_by(db.Item.name).dicts())
+
+
+def get_item(item_id):
+    item = db.Item.select_with_owned().where(db.Item.id == item_id).get()
+    containments = (item.containments
+                    .select(db.Containment, db.Relic, db.RelicTier, db.Rarity)
+                    .join(db.Relic).join(db.RelicTier)
+                    .switch(db.Containment).join(db.Rarity))
+    relics = [dict(relic_summary(c.inside), rarity=c.rarity.name) for c in containments]
+    return dict(item_summary(item),
+                vaulted=all(r['vaulted'] for r in relics),
+                relics=relics,
+                builds=list(item.builds.select(*ITEM_COLUMNS).dicts()),
+                needs=list(item.needs.select(*ITEM_COLUMNS).dicts()),
+                farm_locations=[dict(drop_summary(d), relic=d.drops.name)
+                                for d in item.farm_locations])
+
+
+def get_item_tree(item_id, need_count=1):
+    item = (db.Item.select_with_owned().select(*ITEM_COLUMNS)
+            .where(db.Item.id == item_id).dicts().get())
+    links = (db.BuildRequirement
+             .select(db.BuildRequirement.needs, db.BuildRequirement.need_count)
+             .where(db.BuildRequirement.builds == item_id)
+             .tuples())
+    return dict(item, need_count=need_count,
+                needs=[get_item_tree(needs_id, int(count)) for needs_id, count in links])
+
+
+def get_relics():
+    query = (db.Relic
+             .select(db.Relic.id, db.RelicTier.name, db.Relic.code, db.Relic.vaulted)
+             .join(db.RelicTier)
+             .order_by(db.RelicTier.ordinal, db.Relic.code)
+             .tuples())
+    return [{'id': relic_id, 'name': "{} {}".format(tier, code), 'vaulted': bool(vaulted)}
+            for relic_id, tier, code, vaulted in query]
+
+
+def get_relic(relic_id):
+    relic = db.Relic.select(db.Relic, db.RelicTier).join(db.RelicTier)\
+                    .where(db.Relic.id == relic_id).get()
+    contents = (db.Item.select_with_owned()
+                .select(*ITEM_COLUMNS, db.Rarity.name.alias('rarity'))
+                .join(db.Containment, on=(db.Containment.contains == db.Item.id))
+                .join(db.Rarity)
+                .where(db.Containment.inside == relic_id)
+                .order_by(db.Containment.rarity)
+                .dicts())
+    best_drop = relic.best_drop
+    return dict(relic_summary(relic),
+                contents=list(contents),
+                best_drop=drop_summary(best_drop) if best_drop else None)
+
+
+def get_vault():
+    # an item is vaulted if none of the relics containing it are unvaulted
+    query = (db.Item
+             .select(db.Item.id, db.Item.name, fn.MIN(db.Relic.vaulted).alias('vaulted'))
+             .join(db.Containment, on=db.Containment.contains)
+             .join(db.Relic, on=db.Containment.inside)
+             .group_by(db.Item.id)
+             .order_by(db.Item.name)
+             .dicts())
+    return [dict(row, vaulted=bool(row['vaulted'])) for row in query]
+
+
+def get_profiles():
+    return list(db.Profile.select(db.Profile.id, db.Profile.name).dicts())
+
+
+def get_inventory(profile_id=None):
+    profile = (db.current_profile() if profile_id is None
+               else db.Profile.get_by_id(profile_id))
+    return {str(item_id): owned for item_id, owned in profile.inventory().items()}
+
+
+_ITEM_ID = re.compile(r'[0-9]+')
+
+
+def set_inventory(counts, profile_id=None):
+    '''Set owned counts. Must be called with the write lock held.
+
+    Raises ValueError if any count is invalid or any item does not exist, in which case
+    nothing is written.
+
+    '''
+    profile = (db.current_profile() if profile_id is None
+               else db.Profile.get_by_id(profile_id))
+    # JSON object keys are always strings, so item IDs must be strings of digits
+    if not all(_ITEM_ID.fullmatch(item_id) for item_id in counts):
+        raise ValueError("item IDs must be integers")
+    if not all(isinstance(owned, int) and not isinstance(owned, bool)
+               for owned in counts.values()):
+        raise ValueError("owned counts must be integers")
+    counts = {int(item_id): owned for item_id, owned in counts.items()}
+    if any(owned < 0 for owned in counts.values()):
+        raise ValueError("owned counts must not be negative")
+
+    # foreign keys are not enforced by SQLite, so check the items exist before writing
+    known = set()
+    for batch in chunked(list(counts), 500):
+        known.update(item_id for item_id, in
+                     db.Item.select(db.Item.id).where(db.Item.id.in_(batch)).tuples())
+    unknown = sorted(set(counts) - known)
+    if unknown:
+        raise ValueError("no such items: {}".format(", ".join(map(str, unknown))))
+
+    profile.set_inventory(counts)
+    return {'updated': len(counts)}
+
+
+ROUTES = [
+    (re.compile(r'^/items$'), get_items),
+    (re.compile(r'^/items/(\d+)$'), get_item),
+    (re.compile(r'^/items/(\d+)/tree$'), get_item_tree),
+    (re.compile(r'^/relics$'), get_relics),
+    (re.compile(r'^/relics/(\d+)$'), get_relic),
+    (re.compile(r'^/vault$'), get_vault),
+    (re.compile(r'^/inventory$'), get_inventory),
+    (re.compile(r'^/profiles$'), get_profiles),
+    (re.compile(r'^/profiles/(\d+)/inventory$'), get_inventory),
+]
+'''GET routes, as (path pattern, handler) pairs. Groups are passed to the handler as ints.'''
+
+POST_ROUTES = [
+    (re.compile(r'^/inventory$'), set_inventory),
+    (re.compile(r'^/profiles/(\d+)/inventory$'), set_inventory),
+]
+'''POST routes, as for ROUTES. The decoded JSON body is passed before the groups.'''
+
+
+# Server #
+class ResponseCache:
+    '''Least-recently-used cache of response bodies, invalidated by database generation.'''
+
+    def __init__(self, capacity=CACHE_SIZE):
+        self.capacity = capacity
+        self._generation = None
+        self._bodies = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, generation, path):
+        '''Get the cached body for a path, or None if it is not cached.'''
+        with self._lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._bodies.clear()
+                return None
+            body = self._bodies.get(path)
+            if body is not None: self._bodies.move_to_end(path)
+            return body
+
+    def put(self, generation, path, body):
+        '''Cache the body for a path, as of a database generation.'''
+        with self._lock:
+            if generation != self._generation: return
+            self._bodies[path] = body
+            while len(self._bodies) > self.capacity:
+                self._bodies.popitem(last=False)
+
+
+class PrimeDbRequestHandler(BaseHTTPRequestHandler):
+    '''Handles requests to the prime database service.'''
+
+    protocol_version = 'HTTP/1.1' # keep connections alive between requests
+    disable_nagle_algorithm = True # headers and body are written separately
+    timeout = IDLE_TIMEOUT         # don't let idle or stalled clients hold a worker
+
+    def route(self, routes):
+        '''Find the handler for the request path, returning it and its arguments.'''
+        path = self.path.split('?', 1)[0]
+        for pattern, handler in routes:
+            match = pattern.match(path)
+            if match: return handler, [int(g) for g in match.groups()]
+        return None, None
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        handler, args = self.route(ROUTES)
+        if handler is None:
+            return self.send_json(404, {'error': "No such endpoint: {}".format(path)})
+
+        generation = db.get_generation()
+        body = self.server.cache.get(generation, path)
+        if body is None:
+            try:
+                result = handler(*args)
+            except DoesNotExist:
+                return self.send_json(404, {'error': "Not found: {}".format(path)})
+            body = json.dumps(result).encode('utf-8')
+            self.server.cache.put(generation, path, body)
+        self.send_body(200, body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        handler, args = self.route(POST_ROUTES)
+        if handler is None:
+            return self.send_json(404, {'error': "No such endpoint: {}".format(self.path)})
+        try:
+            counts = json.loads(data.decode('utf-8'))
+            if not isinstance(counts, dict): raise ValueError("expected an object")
+            with self.server.write_lock:
+                result = handler(counts, *args)
+        except (TypeError, ValueError) as e:
+            return self.send_json(400, {'error': "Invalid inventory: {}".format(e)})
+        except DoesNotExist:
+            return self.send_json(404, {'error': "Not found: {}".format(self.path)})
+        self.send_json(200, result)
+
+    def send_json(self, status, obj):
+        self.send_body(status, json.dumps(obj).encode('utf-8'))
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        Logger.debug("Service: " + format % args)
+
+
+class PrimeDbServer(HTTPServer):
+    '''HTTP server handling each connection on a fixed pool of worker threads.
+
+    peewee keeps one connection per thread, so the pool doubles as a pool of read
+    connections.
+
+    '''
+
+    def __init__(self, address, workers=DEFAULT_WORKERS):
+        super().__init__(address, PrimeDbRequestHandler)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.cache = ResponseCache()
+        self.write_lock = Lock()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+def serve(port=DEFAULT_PORT, workers=DEFAULT_WORKERS):
+    '''Serve the database until interrupted.'''
+    db.prepare()
+    db.enable_wal()
+    server = PrimeDbServer(('127.0.0.1', port), workers)
+    Logger.info("Service: Serving {} on port {}".format(db.DB_PATH, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the prime database over HTTP.")
+    parser.add_argument('--db', default=db.DB_PATH, help="database file")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="worker threads, and so clients served at once")
+    args = parser.parse_args()
+    db.set_path(args.db)
+    serve(args.port, args.workers)
+
+if __name__ == '__main__': main()
@@ -0,0 +1,191 @@
+'''Monte Carlo estimates of how many relic runs it takes to complete a prime.
+
+Each missing part is farmed from whichever of its relics gives it the best chance per run.
+Parts that share a relic are farmed in the same runs, so a relic is run until every part
+assigned to it has dropped. A run counts as a success for a part if any member of the
+squad opens the part, as squads can pick any member's reward. Picking only one reward per
+run is not modelled, so results are slightly optimistic when several missing parts come
+from the same relic.
+
+'''
+import numpy as np
+import db.primedb as db
+
+
+REFINEMENTS = ('Intact', 'Exceptional', 'Flawless', 'Radiant')
+SQUAD_SIZES = (1, 2, 3, 4)
+
+DROP_CHANCES = {
+    'Intact':      (0.2533, 0.11, 0.02),
+    'Exceptional': (0.2333, 0.13, 0.04),
+    'Flawless':    (0.20,   0.17, 0.06),
+    'Radiant':     (0.1667, 0.20, 0.10),
+}
+'''Chance of each reward of a rarity dropping, indexed by refinement, then Rarity.ordinal.'''
+
+DEFAULT_TRIALS = 1000000
+
+
+class RunEstimate:
+    '''Distribution of the number of runs needed to complete a set.'''
+
+    def __init__(self, runs):
+        self.mean = float(runs.mean())
+        # runs are small integers, so counting them is much faster than sorting them
+        cumulative = np.cumsum(np.bincount(runs))
+        self.p50, self.p90 = (int(np.searchsorted(cumulative, q * (len(runs) - 1), 'right'))
+                              for q in (0.5, 0.9))
+
+    def __str__(self):
+        return "mean {:.1f}, p50 {}, p90 {}".format(self.mean, self.p50, self.p90)
+
+
+def missing_parts(product):
+    '''Get the parts still needed to build a product, by the current profile.
+
+    RETURNS
+    List of (part, count) tuples, where count is how many more of the part are needed.
+
+    '''
+    inventory = db.current_profile().inventory()
+    requirements = (product.component_links
+                    .select(db.BuildRequirement, db.Item)
+                    .join(db.Item, on=db.BuildRequirement.needs))
+    return [(req.needs, int(req.need_count) - inventory.get(req.needs_id, 0))
+            for req in requirements
+            if int(req.need_count) > inventory.get(req.needs_id, 0)]
+
+
+def best_relics(parts, refinement, include_vaulted=False):
+    '''Find the relic with the best chance of dropping each part.
+
+    PARAMETERS
+    parts: Parts to find relics for.
+    refinement: Refinement level the relics will be opened at.
+    include_vaulted: If True, consider vaulted relics as well.
+
+    RETURNS
+    List of (relic, chance) tuples, one per part.
+
+    '''
+    chances = DROP_CHANCES[refinement]
+    best = []
+    for part in parts:
+        candidates = [(c.inside, chances[c.rarity.ordinal]) for c in part.containments
+                      if include_vaulted or not c.inside.vaulted]
+        if not candidates:
+            raise ValueError("{} is not in any {}relic"
+                             .format(part, "" if include_vaulted else "unvaulted "))
+        best.append(max(candidates, key=lambda candidate: candidate[1]))
+    return best
+
+
+def draw_log_uniforms(counts, trials=DEFAULT_TRIALS, rng=None):
+    '''Draw the random numbers that simulate_runs turns into runs.
+
+    Simulations of the same parts given the same draws share their randomness, which is
+    much faster than drawing afresh for each, and makes their results directly comparable.
+
+    PARAMETERS
+    counts: How many of each part are needed.
+    trials: Number of trials to simulate.
+    rng: numpy Generator to draw from. If None, a new unseeded one is used.
+
+    RETURNS
+    List of arrays, one per part, each of shape (count, trials), holding the logs of
+    uniform draws from (0, 1].
+
+    '''
+    if rng is None: rng = np.random.default_rng()
+    return [np.log(1 - rng.random((int(count), trials))) for count in counts]
+
+
+def simulate_runs(counts, chances, groups, squad_size=1, trials=DEFAULT_TRIALS, rng=None,
+                  draws=None):
+    '''Simulate the number of runs needed to collect a set of parts.
+
+    PARAMETERS
+    counts: How many of each part are needed.
+    chances: Chance of each part dropping when one player opens its relic.
+    groups: Lists of indices into counts and chances, one per relic; parts in the same
+            group are farmed in the same runs.
+    squad_size: Number of players opening the relic each run.
+    trials: Number of trials to simulate. Ignored if draws are given.
+    rng: numpy Generator to draw from. If None, a new unseeded one is used. Ignored if
+         draws are given.
+    draws: Draws from draw_log_uniforms for the same counts. If None, new ones are drawn.
+
+    RETURNS
+    Array with the number of runs needed in each trial.
+
+    '''
+    if draws is None: draws = draw_log_uniforms(counts, trials, rng)
+    counts = np.asarray(counts, dtype=np.int64)
+    chances = 1 - (1 - np.asarray(chances, dtype=np.float64)) ** squad_size
+    runs = np.zeros(draws[0].shape[1])
+    for group in groups:
+        # each copy of a part takes a geometrically distributed number of runs, sampled
+        # by inverting its distribution function
+        group_runs = None
+        for i in group:
+            part_runs = np.floor(draws[i] / np.log1p(-chances[i])).sum(axis=0) + counts[i]
+            group_runs = (part_runs if group_runs is None
+                          else np.maximum(group_runs, part_runs, out=group_runs))
+        runs += group_runs
+    return runs.astype(np.int64)
+
+
+def group_by_relic(relics):
+    '''Group part indices by the relic they are farmed from, for simulate_runs.'''
+    groups = {}
+    for i, relic in enumerate(relics):
+        groups.setdefault(relic.id, []).append(i)
+    return list(groups.values())
+
+
+def estimate_runs(product, refinement='Intact', squad_size=1, trials=DEFAULT_TRIALS,
+                  include_vaulted=False, rng=None):
+    '''Estimate how many relic runs it will take to complete a product.
+
+    PARAMETERS
+    product: Product to complete.
+    refinement: Refinement level the relics will be opened at.
+    squad_size: Number of players opening the relic each run.
+    trials: Number of trials to simulate.
+    include_vaulted: If True, allow parts to be farmed from vaulted relics.
+    rng: numpy Generator to draw from. If None, a new unseeded one is used.
+
+    RETURNS
+    RunEstimate, or None if no parts are missing.
+
+    '''
+    missing = missing_parts(product)
+    if not missing: return None
+    parts, counts = zip(*missing)
+    relics, chances = zip(*best_relics(parts, refinement, include_vaulted))
+    return RunEstimate(simulate_runs(counts, chances, group_by_relic(relics),
+                                     squad_size, trials, rng))
+
+
+def estimate_all_runs(product, trials=DEFAULT_TRIALS, include_vaulted=False, rng=None):
+    '''Estimate runs to complete a product at every refinement level and squad size.
+
+    Parameters are as for estimate_runs.
+
+    RETURNS
+    Dict mapping (refinement, squad_size) to RunEstimate, or None if no parts are missing.
+
+    '''
+    missing = missing_parts(product)
+    if not missing: return None
+    parts, counts = zip(*missing)
+    draws = draw_log_uniforms(counts, trials, rng) # shared by every configuration
+
+    estimates = {}
+    for refinement in REFINEMENTS:
+        relics, chances = zip(*best_relics(parts, refinement, include_vaulted))
+        groups = group_by_relic(relics)
+        for squad_size in SQUAD_SIZES:
+            estimates[refinement, squad_size] = RunEstimate(
+                simulate_runs(counts, chances, groups, squad_size, draws=draws))
+    return estimates
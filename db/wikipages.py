@@ -0,0 +1,60 @@
+'''Parsing of wiki pages that needs neither the database nor Kivy.
+
+Kept separate from db.primedb so that worker processes can import it without importing
+Kivy.
+
+'''
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+def parse_product_requirements(product_id, product_page):
+    '''Extract a product's image and the parts required to build it from its wiki page.
+
+    Only parses the page's images and tables.
+
+    PARAMETERS
+    product_id: ID of the product, passed through to the result.
+    product_page: Contents of the product's wiki page.
+
+    RETURNS
+    (product_id, image_url, parts) tuple, where image_url is as for get_page_image_url and
+    parts is a list of (part_name, count, image_url) tuples, one per part in the foundry
+    table. parts is empty if the page has no foundry table.
+
+    '''
+    strainer = SoupStrainer(['figure', 'meta', 'table'])
+    soup = BeautifulSoup(product_page, 'lxml', parse_only=strainer)
+    image_url = get_page_image_url(soup)
+    foundry_table = soup.find('table', class_='foundrytable')
+    if foundry_table is None:
+        return product_id, image_url, []
+    return product_id, image_url, [
+        (req.a['title'].strip(), req.text.strip(), get_img_url(req.img) if req.img else None)
+        for req in foundry_table.contents[3].find_all('td') if req.a]
+
+
+def get_page_image_url(soup):
+    '''Find the URL of the main image on a wiki page.
+
+    Prefers the image in the page's infobox, falling back on the page's OpenGraph image.
+    Returns None if the page has no image.
+
+    PARAMETERS
+    soup: The parsed page. Must include at least the page's <figure> and <meta> tags.
+
+    '''
+    figure = soup.find('figure', class_='pi-image')
+    if figure and figure.img:
+        return get_img_url(figure.img)
+    meta = soup.find('meta', property='og:image')
+    if meta and meta.get('content'):
+        return meta['content']
+    return None
+
+
+def get_img_url(img):
+    '''Get the URL of an <img> tag, accounting for the wiki's lazy loading.'''
+    url = img.get('data-src') or img.get('src')
+    if url is None or url.startswith('data:'):
+        return None
+    return url
@@ -1,3 +1,6 @@
 import gui.dbentry as dbentry
+import gui.image as image
+import gui.lazykv as lazykv
 import gui.input as input
 import gui.popup as popup
+import gui.report as report
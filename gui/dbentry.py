@@ -1,17 +1,21 @@
 import db.primedb as db
+import gui.image as image
 
-from kivy.lang.builder import Builder
+from gui.lazykv import kv_rules
+
+from functools import partial
+
+from kivy.clock import Clock
 from kivy.logger import Logger
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.recycleview import RecycleView
 from kivy.uix.tabbedpanel import TabbedPanelItem
 from kivy.uix.widget import Widget
 
 from kivy.properties import *
 
 
-Builder.load_file('gui/dbentry.kv')
-
-
+@kv_rules('gui/dbentry.kv')
 class DbEntryListing(BoxLayout):
     '''Image, name and information about an database entry.
 
@@ -19,8 +23,15 @@ class DbEntryListing(BoxLayout):
 
     '''
 
+    image_url = StringProperty()
+    '''URL of the image to display alongside the listing.'''
+
     image_path = StringProperty()
-    '''Path to the image to display alongside the listing.'''
+    '''Path to the image to display alongside the listing.
+
+    Filled in with the path of a cached thumbnail once one is available for `image_url`.
+
+    '''
 
     entry = ObjectProperty()
     '''Database entry to display information about.'''
@@ -41,19 +52,49 @@ class DbEntryListing(BoxLayout):
         # if type check passes, proceed through MRO
         super().__init__(**kwargs)
 
+    def on_image_url(self, instance, url):
+        '''Callback for when the image URL changes.'''
+        self.image_path = ''
+        if url:
+            image.thumbnails.fetch(url, partial(self._on_thumbnail, url))
+
+    def _on_thumbnail(self, url, path):
+        '''Callback for when the thumbnail for an image URL is available.'''
+        if url == self.image_url: # URL may have changed while downloading
+            self.image_path = path
+
 
 class DbItemListing(DbEntryListing):
     '''Entry listing for Item records.'''
 
+    owned = NumericProperty()
+    '''Number of the item in the player's inventory. Kept up to date with the database.'''
+
     def __init__(self, item, **kwargs):
         super().__init__(entry=item, type_filter=db.Item, **kwargs)
+        db.subscribe(db.InventoryChanged, self.on_inventory_changed)
+
+    def on_inventory_changed(self, event):
+        '''Callback for when any owned counts are saved, singly or in bulk.'''
+        owned = event.counts.get(self.entry.id)
+        if owned is not None and event.profile == db.current_profile():
+            Clock.schedule_once(lambda _: setattr(self, 'owned', owned))
 
 
 class DbRelicListing(DbEntryListing):
     '''Entry listing for Relic records/'''
 
+    vaulted = BooleanProperty()
+    '''Whether the relic is vaulted. Kept up to date with the database.'''
+
     def __init__(self, relic, **kwargs):
         super().__init__(entry=relic, type_filter=db.Relic, **kwargs)
+        db.subscribe(db.RelicVaulted, self.on_relic_vaulted)
+
+    def on_relic_vaulted(self, event):
+        '''Callback for when any relic is vaulted or unvaulted.'''
+        if event.relic == self.entry:
+            Clock.schedule_once(lambda _: setattr(self, 'vaulted', event.vaulted))
 
 
 class DbContainmentListing(DbEntryListing):
@@ -75,9 +116,21 @@ class DbContainmentForContentsListing(DbContainmentListing):
 
 class DbContainmentForRelicListing(DbContainmentListing):
     '''Entry listing for showing which Relics contain an Item.'''
-    pass
 
+    vaulted = BooleanProperty()
+    '''Whether the relic is vaulted. Kept up to date with the database.'''
 
+    def __init__(self, containment, **kwargs):
+        super().__init__(containment, **kwargs)
+        db.subscribe(db.RelicVaulted, self.on_relic_vaulted)
+
+    def on_relic_vaulted(self, event):
+        '''Callback for when any relic is vaulted or unvaulted.'''
+        if event.relic.id == self.entry.inside_id:
+            Clock.schedule_once(lambda _: setattr(self, 'vaulted', event.vaulted))
+
+
+@kv_rules('gui/dbentry.kv')
 class DbEntryList(BoxLayout):
     '''Container for DbEntryListings.'''
 
@@ -97,7 +150,28 @@ class DbEntryList(BoxLayout):
         self.add_widget(Widget())
         return listing # TODO remove once no longer required
 
+    def remove(self, entry):
+        '''Remove any DbEntryListings for a database entry from the list.'''
+        for listing in [c for c in self.children
+                        if isinstance(c, DbEntryListing) and c.entry == entry]:
+            self.remove_widget(listing)
+
+
+@kv_rules('gui/dbentry.kv')
+class DbEntryRecycleList(RecycleView):
+    '''Scrolling list of DbEntryListings that only creates widgets for visible rows.
+
+    Rows are described by `data`, a list of dicts of listing properties (at least
+    `entry`). Listings are reused as the list scrolls, so `viewclass` must be a
+    DbEntryListing subclass that can be created without arguments.
 
+    '''
+
+    listing_height = NumericProperty(96)
+    '''Height of each listing.'''
+
+
+@kv_rules('gui/dbentry.kv')
 class DbEntryListTab(TabbedPanelItem):
     '''Tab for containing a DbEntryList.'''
 
@@ -105,7 +179,12 @@ class DbEntryListTab(TabbedPanelItem):
         '''Add a new DbEntryListing to the contained DbEntryList.'''
         self.ids.item_list.add(item)
 
+    def remove(self, entry):
+        '''Remove any DbEntryListings for a database entry from the contained DbEntryList.'''
+        self.ids.item_list.remove(entry)
 
+
+@kv_rules('gui/dbentry.kv')
 class DbEntryDetailView(BoxLayout):
     '''Shows detailed information about a database entry.
 
@@ -142,6 +221,8 @@ class ComponentView(DbEntryDetailView):
         self.ids.sublist_tabs.add_widget(self.ids.relic_tab)
         for containment in component.containments:
             self.ids.relic_tab.add(DbContainmentForRelicListing(containment))
+        db.subscribe(db.ContainmentAdded, self.on_containment_added)
+        db.subscribe(db.ContainmentRemoved, self.on_containment_removed)
 
         # Create and populate Products tab #
         self.ids.product_tab = DbEntryListTab(text = "Products")
@@ -150,6 +231,17 @@ class ComponentView(DbEntryDetailView):
             self.ids.product_tab.add(DbItemListing(product))
         self.ids.sublist_tabs.default_tab = self.ids.product_tab
 
+    def on_containment_added(self, event):
+        '''Callback for when a containment relation is saved.'''
+        if event.containment.contains_id == self.ids.heading.entry.id:
+            Clock.schedule_once(lambda _: self.ids.relic_tab.add(
+                DbContainmentForRelicListing(event.containment)))
+
+    def on_containment_removed(self, event):
+        '''Callback for when a containment relation is deleted.'''
+        if event.containment.contains_id == self.ids.heading.entry.id:
+            Clock.schedule_once(lambda _: self.ids.relic_tab.remove(event.containment))
+
 
 class RelicView(DbEntryDetailView):
     '''Shows information about a relic.'''
@@ -164,3 +256,16 @@ class RelicView(DbEntryDetailView):
         for containment in relic.containments.order_by(db.Containment.rarity):
             self.ids.contents_tab.add(DbContainmentForContentsListing(containment))
         self.ids.sublist_tabs.default_tab = self.ids.contents_tab
+        db.subscribe(db.ContainmentAdded, self.on_containment_added)
+        db.subscribe(db.ContainmentRemoved, self.on_containment_removed)
+
+    def on_containment_added(self, event):
+        '''Callback for when a containment relation is saved.'''
+        if event.containment.inside_id == self.ids.heading.entry.id:
+            Clock.schedule_once(lambda _: self.ids.contents_tab.add(
+                DbContainmentForContentsListing(event.containment)))
+
+    def on_containment_removed(self, event):
+        '''Callback for when a containment relation is deleted.'''
+        if event.containment.inside_id == self.ids.heading.entry.id:
+            Clock.schedule_once(lambda _: self.ids.contents_tab.remove(event.containment))
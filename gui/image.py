@@ -0,0 +1,197 @@
+import certifi, hashlib, io, os, re, urllib3
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from urllib.parse import urlparse
+
+from kivy.clock import Clock
+from kivy.loader import Loader
+from kivy.logger import Logger
+from kivy.uix.image import Image
+
+from kivy.properties import *
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+
+THUMBNAIL_DIR = 'thumbnails'
+THUMBNAIL_SIZE = (128, 128)
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_TIMEOUT = urllib3.Timeout(connect=5, read=15)
+TEXTURE_CACHE_SIZE = 256
+
+_WIKI_REVISION = re.compile(r'(/revision/latest)(?:/scale-to-width-down/\d+)?')
+'''Matches the revision part of a wiki image URL, and any scaling already applied to it.'''
+
+
+def scaled_url(url, width):
+    '''Get the URL of a wiki image scaled down by the wiki's image server.
+
+    The wiki's image server shrinks an image if /scale-to-width-down/<width> follows the
+    revision in its URL. URLs of other images are returned unchanged.
+
+    '''
+    return _WIKI_REVISION.sub(r'\1/scale-to-width-down/{}'.format(int(width)), url, count=1)
+
+
+class ThumbnailCache:
+    '''Downloads images and keeps resized copies of them on disk.
+
+    Thumbnails are stored in a directory, named after a hash of the URL they were
+    downloaded from, so each image only ever has to be downloaded once. Downloads run on a
+    bounded pool of worker threads, and callbacks are always run on the main thread.
+
+    Wiki images are downloaded already scaled down by the wiki's image server, then
+    resized to fit exactly if Pillow is available. Without Pillow, images from elsewhere
+    are stored at their original size.
+
+    '''
+
+    def __init__(self, directory=THUMBNAIL_DIR, size=THUMBNAIL_SIZE,
+                 workers=DOWNLOAD_WORKERS):
+        self.directory = directory
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._http = urllib3.PoolManager(maxsize=workers, timeout=DOWNLOAD_TIMEOUT,
+                                         cert_reqs='CERT_REQUIRED',
+                                         ca_certs=certifi.where())
+        self._pending = {} # url -> list of callbacks waiting on the download
+        self._lock = Lock()
+        if PILImage is None:
+            Logger.warning("GUI-Image: Pillow not found, only wiki images will be resized")
+
+    def path(self, url):
+        '''Get the path the thumbnail for an image URL is stored at.'''
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        if PILImage is None:
+            extension = os.path.splitext(urlparse(url).path)[1] or '.png'
+        else:
+            extension = '.png'
+        return os.path.join(self.directory, digest + extension)
+
+    def fetch(self, url, callback):
+        '''Get the thumbnail for an image URL, downloading it if necessary.
+
+        PARAMETERS
+        url: URL of the full-size image.
+        callback: Called on the main thread with the path of the thumbnail once it is
+                  available. Not called if the download fails.
+
+        '''
+        path = self.path(url)
+        if os.path.isfile(path):
+            callback(path)
+            return
+
+        with self._lock:
+            if url in self._pending:
+                self._pending[url].append(callback)
+                return
+            self._pending[url] = [callback]
+        self._executor.submit(self._download, url, path)
+
+    def _download(self, url, path):
+        '''Download an image and write its thumbnail to disk. Runs on a worker thread.'''
+        try:
+            r = self._http.request('GET', scaled_url(url, self.size[0]))
+            if r.status != 200:
+                raise IOError("HTTP status {}".format(r.status))
+            data = self._resize(r.data)
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = path + '.part'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path) # readers never see a partial file
+        except Exception as e:
+            Logger.warning("GUI-Image: Failed to download {}: {}".format(url, e))
+            with self._lock:
+                del self._pending[url]
+            return
+
+        with self._lock:
+            callbacks = self._pending.pop(url)
+        for callback in callbacks:
+            Clock.schedule_once(lambda _, callback=callback: callback(path))
+
+    def _resize(self, data):
+        '''Shrink image data to fit within the thumbnail size.'''
+        if PILImage is None:
+            return data
+        image = PILImage.open(io.BytesIO(data))
+        image.thumbnail(self.size)
+        out = io.BytesIO()
+        image.save(out, format='PNG')
+        return out.getvalue()
+
+
+class TextureCache:
+    '''Least-recently-used cache of decoded textures.
+
+    Bounds the number of textures kept alive by the image pipeline, and so the amount of
+    GPU memory it uses.
+
+    '''
+
+    def __init__(self, capacity=TEXTURE_CACHE_SIZE):
+        self.capacity = capacity
+        self._textures = OrderedDict()
+
+    def get(self, key):
+        '''Get a cached texture, or None if it is not cached.'''
+        texture = self._textures.get(key)
+        if texture is not None:
+            self._textures.move_to_end(key)
+        return texture
+
+    def put(self, key, texture):
+        '''Add a texture to the cache, evicting the least recently used if full.'''
+        self._textures[key] = texture
+        self._textures.move_to_end(key)
+        while len(self._textures) > self.capacity:
+            self._textures.popitem(last=False)
+
+
+thumbnails = ThumbnailCache()
+'''Shared thumbnail cache.'''
+
+textures = TextureCache()
+'''Shared texture cache.'''
+
+
+class CachedImage(Image):
+    '''Image that decodes its file asynchronously and shares textures through a cache.
+
+    Use `path` rather than `source` to set the displayed file.
+
+    '''
+
+    path = StringProperty()
+    '''Path of the image file to display.'''
+
+    def on_path(self, instance, path):
+        '''Callback for when the path changes.'''
+        self.texture = None
+        if not path:
+            return
+        texture = textures.get(path)
+        if texture is not None:
+            self.texture = texture
+            return
+        proxy = Loader.image(path)
+        if proxy.loaded:
+            self._on_proxy_load(path, proxy)
+        else:
+            proxy.bind(on_load=partial(self._on_proxy_load, path))
+
+    def _on_proxy_load(self, path, proxy):
+        '''Callback for when the Loader finishes decoding an image.'''
+        if proxy.texture is None:
+            return
+        textures.put(path, proxy.texture)
+        if path == self.path: # path may have changed while loading
+            self.texture = proxy.texture
@@ -1,5 +1,6 @@
+from gui.lazykv import kv_rules
+
 from kivy.clock import Clock
-from kivy.lang.builder import Builder
 from kivy.logger import Logger
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.textinput import TextInput
@@ -7,9 +8,7 @@ from kivy.uix.textinput import TextInput
 from kivy.properties import *
 
 
-Builder.load_file('gui/input.kv')
-
-
+@kv_rules('gui/input.kv')
 class DynamicTextInput(TextInput):
     '''TextInput with additional features for interacting with other elements.
 
@@ -44,6 +43,7 @@ class DynamicTextInput(TextInput):
         pass
 
 
+@kv_rules('gui/input.kv')
 class SpinCounter(BoxLayout):
     '''Widget for entering integer values.
 
@@ -0,0 +1,40 @@
+from functools import wraps
+from threading import Lock
+
+from kivy.lang.builder import Builder
+from kivy.logger import Logger
+
+
+_loaded = set()
+_lock = Lock()
+
+
+def load_kv(path):
+    '''Load a kv file, unless it has already been loaded.'''
+    with _lock:
+        if path in _loaded:
+            return
+        Logger.debug("GUI-LazyKv: Loading {}".format(path))
+        Builder.load_file(path)
+        _loaded.add(path)
+
+
+def kv_rules(path):
+    '''Class decorator to load a kv file the first time the class is instantiated.
+
+    Rules are applied during Widget.__init__, so the file is loaded before the decorated
+    class's own __init__ runs. Subclasses inherit the behaviour, so only the root of each
+    class hierarchy in a kv file needs decorating.
+
+    '''
+    def decorator(cls):
+        init = cls.__init__
+
+        @wraps(init)
+        def __init__(self, *args, **kwargs):
+            load_kv(path)
+            init(self, *args, **kwargs)
+
+        cls.__init__ = __init__
+        return cls
+    return decorator
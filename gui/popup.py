@@ -1,19 +1,18 @@
 import certifi, urllib3
 import db.primedb as db
 
+from gui.lazykv import kv_rules
+
 from functools import partial
 from threading import Thread
 
 from kivy.clock import Clock
-from kivy.lang.builder import Builder
 from kivy.uix.popup import Popup
 
 from kivy.properties import *
 
 
-Builder.load_file('gui/popup.kv')
-
-
+@kv_rules('gui/popup.kv')
 class ProgressPopup(Popup):
     '''Popup window to provide information about multi-step tasks.
 
@@ -95,7 +94,7 @@ class DbPopulatePopup(ProgressPopup):
         Called automatically when the popup opens.
 
         '''
-        self.phase_count = 2
+        self.phase_count = 3
         self.execution = Thread(target=partial(DbPopulatePopup.populate, self)).start()
 
     def populate(self):
@@ -113,15 +112,21 @@ class DbPopulatePopup(ProgressPopup):
             Clock.schedule_once(lambda _: self.step())
 
         # Determine Build Requirements for Each Product #
-        products = db.Item.select_all_products()
+        products = list(db.Item.select_all_products())
         Clock.schedule_once(lambda _: self.new_phase(len(products), "Processing build requirements"))
-        for product in db.Item.select_all_products():
-            db.calculate_product_requirement_quantities(product)
-            Clock.schedule_once(lambda _: self.step())
+        db.calculate_all_requirement_quantities(
+            products, progress=lambda: Clock.schedule_once(lambda _: self.step()))
+
+        # Record Which Missions Reward Each Relic #
+        rows = db.get_mission_reward_table(http)
+        Clock.schedule_once(lambda _: self.new_phase(len(rows), "Processing mission rewards"))
+        db.ingest_mission_rewards(db.iter_mission_rewards(
+            rows, progress=lambda: Clock.schedule_once(lambda _: self.step())))
         db.population_teardown()
         self.dismiss()
 
 
+@kv_rules('gui/popup.kv')
 class InventoryInitPopup(Popup):
     '''Initializes inventory of primes, parts, and relics.'''
 
@@ -0,0 +1,59 @@
+import db.primedb as db
+
+from gui.dbentry import DbEntryListing
+from gui.lazykv import kv_rules
+
+from kivy.clock import Clock
+from kivy.uix.boxlayout import BoxLayout
+
+from kivy.properties import *
+
+
+@kv_rules('gui/report.kv')
+class DbSurplusListing(DbEntryListing):
+    '''Entry listing for a part owned beyond what unbuilt products need.'''
+
+    owned = NumericProperty()
+    '''Number of the part in the player's inventory.'''
+
+    needed = NumericProperty()
+    '''Number of the part needed to build every unbuilt product.'''
+
+    surplus = NumericProperty()
+    '''Number of the part owned beyond what is needed.'''
+
+    value = NumericProperty()
+    '''Estimated ducats received for trading in the whole surplus.'''
+
+    def __init__(self, **kwargs):
+        super().__init__(type_filter=db.Item, **kwargs)
+
+
+@kv_rules('gui/report.kv')
+class SurplusReportView(BoxLayout):
+    '''Shows surplus parts ranked by estimated ducat value, and their total value.
+
+    Refreshes itself whenever owned counts change.
+
+    '''
+
+    total_value = NumericProperty()
+    '''Estimated ducats received for trading in every surplus part.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._refresh = Clock.create_trigger(self.refresh)
+        self.refresh()
+        db.subscribe(db.InventoryChanged, self.on_inventory_changed)
+
+    def refresh(self, *args):
+        '''Recompute the surplus and update the list.'''
+        self.ids.surplus_list.data = [
+            {'entry': part, 'owned': part.owned, 'needed': part.needed,
+             'surplus': part.surplus, 'value': part.value}
+            for part in db.Item.select_surplus()]
+        self.total_value = sum(row['value'] for row in self.ids.surplus_list.data)
+
+    def on_inventory_changed(self, event):
+        '''Callback for when any owned counts are saved, singly or in bulk.'''
+        Clock.schedule_once(lambda _: self._refresh())
@@ -1,20 +1,74 @@
 #!/usr/bin/env python3
 
+import os, time
 import db.primedb as db
+
+from threading import Thread
+
 from kivy.app import App
+from kivy.clock import Clock
+from kivy.logger import Logger
 from kivy.uix.boxlayout import BoxLayout
-from test.menu import TestingMenu
+from kivy.uix.label import Label
+
+
+STARTUP_TIMING_VAR = 'PRIMETRACKER_STARTUP_TIMING'
+'''If this environment variable is set, report startup timings and exit once started.'''
+
+# Worker processes spawned by the database import this module, so anything that opens a
+# window (kivy.core.window, and widgets such as popups that import it) is imported where
+# it is used instead of here.
 
 
 class PrimeTrackerApp(App):
     def build(self):
         root = BoxLayout(orientation='vertical')
-        root.add_widget(TestingMenu())
+        root.add_widget(Label(text="Opening database..."))
+        if os.environ.get(STARTUP_TIMING_VAR):
+            from kivy.core.window import Window
+            Window.bind(on_flip=self.report_first_frame)
         return root
 
+    def on_start(self):
+        Thread(target=self.prepare_db, daemon=True).start()
+
+    def prepare_db(self):
+        '''Create or update the database. Runs on a background thread.'''
+        try:
+            db.prepare()
+        except Exception as e:
+            Logger.exception("PrimeTracker: Failed to open database")
+            Clock.schedule_once(lambda _, e=e: self.on_db_error(e))
+            return
+        Clock.schedule_once(self.on_db_ready)
+
+    def on_db_ready(self, *args):
+        '''Callback for when the database is ready to use.'''
+        from test.menu import TestingMenu
+        db.open_()
+        self.root.clear_widgets()
+        self.root.add_widget(TestingMenu())
+        if os.environ.get(STARTUP_TIMING_VAR):
+            print("db-ready {}".format(time.time()), flush=True)
+            Clock.schedule_once(lambda _: self.stop())
+
+    def on_db_error(self, error):
+        '''Callback for when the database could not be created or updated.'''
+        self.root.clear_widgets()
+        self.root.add_widget(Label(text="Could not open database {}:\n{}"
+                                        .format(db.DB_PATH, error)))
+        if os.environ.get(STARTUP_TIMING_VAR):
+            print("db-error {}".format(error), flush=True)
+            Clock.schedule_once(lambda _: self.stop())
+
+    def report_first_frame(self, *args):
+        '''Print the time the first frame was drawn.'''
+        from kivy.core.window import Window
+        Window.unbind(on_flip=self.report_first_frame)
+        print("first-frame {}".format(time.time()), flush=True)
+
 
 def main():
-    db.open_()
     PrimeTrackerApp().run()
     db.close()
 
@@ -2,6 +2,7 @@ import db.primedb as db
 from gui.dbentry import\
     ComponentView, ProductView, RelicView,\
     DbContainmentForContentsListing, DbContainmentForRelicListing, DbItemListing, DbRelicListing
+from gui.report import SurplusReportView
 
 
 class TestDb:
@@ -44,6 +45,11 @@ def test_relic_view(parent_widget):
     parent_widget.add_widget(RelicView(db.Relic.select()[0]))
 
 
+def test_surplus_view(parent_widget):
+    parent_widget.clear_widgets()
+    parent_widget.add_widget(SurplusReportView())
+
+
 def test_DbEntryListing_subclasses():
     test_db = TestDb()
 
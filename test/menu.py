@@ -1,14 +1,13 @@
 import test
 
-from kivy.lang.builder import Builder
+from gui.lazykv import kv_rules
+
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.label import Label
 
 
-Builder.load_file('test/menu.kv')
-
-
+@kv_rules('test/menu.kv')
 class TestingButton(Button):
     '''A button ideal for testing new features.'''
     def on_release(self):
@@ -17,10 +16,12 @@ class TestingButton(Button):
         super().on_release()
 
 
+@kv_rules('test/menu.kv')
 class TestHeading(Label):
     pass
 
 
+@kv_rules('test/menu.kv')
 class TestingMenu(BoxLayout):
     def test(self, root):
         test.gui.test_relic_view(root)
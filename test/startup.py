@@ -0,0 +1,58 @@
+'''Cold-start timing harness.
+
+Launches the app repeatedly in fresh processes and reports how long it takes to draw its
+first frame and to finish opening the database. Run from the repository root:
+
+    $ python3 -m test.startup [runs]
+
+'''
+import os, statistics, subprocess, sys, time
+
+
+STARTUP_TIMING_VAR = 'PRIMETRACKER_STARTUP_TIMING' # see primetrackerapp.py
+TIMEOUT = 60 # seconds before a run that has not exited is counted as failed
+
+
+def time_startup():
+    '''Launch the app once, returning seconds to first frame and to database ready.
+
+    Returns None, after printing the reason, if the app fails, hangs, or exits without
+    reporting both times.
+
+    '''
+    env = dict(os.environ, **{STARTUP_TIMING_VAR: '1', 'KIVY_NO_ARGS': '1'})
+    start = time.time()
+    try:
+        out = subprocess.run([sys.executable, 'primetrackerapp.py'], env=env,
+                             stdout=subprocess.PIPE, universal_newlines=True,
+                             timeout=TIMEOUT, check=True).stdout
+    except subprocess.TimeoutExpired:
+        print("Run failed: no exit within {}s".format(TIMEOUT))
+        return None
+    except subprocess.CalledProcessError as e:
+        print("Run failed: exit status {}".format(e.returncode))
+        return None
+    times = dict(line.split(' ', 1) for line in out.splitlines()
+                 if line.startswith(('first-frame ', 'db-ready ', 'db-error ')))
+    if 'db-error' in times:
+        print("Run failed: {}".format(times['db-error']))
+        return None
+    missing = [marker for marker in ('first-frame', 'db-ready') if marker not in times]
+    if missing:
+        print("Run failed: {} not reported".format(", ".join(missing)))
+        return None
+    return float(times['first-frame']) - start, float(times['db-ready']) - start
+
+
+def main(runs=5):
+    results = [time_startup() for _ in range(runs)]
+    results = [result for result in results if result is not None]
+    if len(results) < runs:
+        print("{} of {} runs failed".format(runs - len(results), runs))
+    for label, values in zip(("First frame", "Database ready"), zip(*results)):
+        print("{}: median {:.3f}s, min {:.3f}s, max {:.3f}s over {} runs"
+              .format(label, statistics.median(values), min(values), max(values),
+                      len(results)))
+    return 1 if len(results) < runs else 0
+
+if __name__ == '__main__': sys.exit(main(*map(int, sys.argv[1:])))